@@ -4,6 +4,8 @@ import pandas as pd
 import numpy as np
 from datetime import datetime
 from io import BytesIO
+import xlsxwriter
+from numba import njit
 
 # Configuração inicial da página
 st.set_page_config(
@@ -20,39 +22,181 @@ def convert_df(df):
 
 @st.cache_data
 def to_excel(df):
-    """Converte o DataFrame para Excel."""
+    """Converte o DataFrame para Excel.
+
+    O modo constant_memory do xlsxwriter descarrega cada linha assim que ela é
+    escrita. Ele exige gravação linha a linha, por isso as células são escritas
+    direto no xlsxwriter em vez de df.to_excel, que grava coluna a coluna.
+    """
     output = BytesIO()
-    writer = pd.ExcelWriter(output, engine='xlsxwriter')
-    df.to_excel(writer, index=False, sheet_name='RFV_Segmentado')
-    writer.close()
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'strings_to_numbers': False})
+    worksheet = workbook.add_worksheet('RFV_Segmentado')
+    worksheet.write_row(0, 0, df.columns, workbook.add_format({'bold': True}))
+    for linha, valores in enumerate(df.itertuples(index=False, name=None), start=1):
+        # write_number não aceita NaN: None vira célula vazia, como no df.to_excel
+        worksheet.write_row(linha, 0, [None if pd.isna(v) else v for v in valores])
+    workbook.close()
     processed_data = output.getvalue()
     return processed_data
 
+@st.cache_data
+def to_parquet(df):
+    """Converte o DataFrame para Parquet."""
+    return df.to_parquet(index=False)
+
 # Funções para Classificação de Quartis
-def recencia_class(x, r, q_dict):
-    """Classifica a Recência (menor é melhor)."""
-    if x <= q_dict[r][0.25]:
-        return 'A'
-    elif x <= q_dict[r][0.50]:
-        return 'B'
-    elif x <= q_dict[r][0.75]:
-        return 'C'
+LETRAS_QUARTIS = np.array(list('ABCD'))
+# Os 64 scores possíveis, indexados por R * 16 + F * 4 + V
+TABELA_SCORES = np.array([r + f + v for r in 'ABCD' for f in 'ABCD' for v in 'ABCD'])
+
+@njit(inline='always')
+def quartil(x, q):
+    """Índice do quartil de x pelos limites q (x <= q25 -> 0, x <= q50 -> 1, ...)."""
+    if x <= q[0]:
+        return 0
+    elif x <= q[1]:
+        return 1
+    elif x <= q[2]:
+        return 2
     else:
-        return 'D'
-
-def freq_val_class(x, fv, q_dict):
-    """Classifica Frequência e Valor (maior é melhor)."""
-    if x <= q_dict[fv][0.25]:
-        return 'D'
-    elif x <= q_dict[fv][0.50]:
-        return 'C'
-    elif x <= q_dict[fv][0.75]:
-        return 'B'
+        return 3
+
+@njit(fastmath=True)
+def classifica_rfv(R, F, V, qR, qF, qV, outR, outF, outV):
+    """Preenche os códigos de quartil (0 = 'A' ... 3 = 'D') das três componentes numa única passada.
+
+    Para Recência menor é melhor; para Frequência e Valor a ordem é invertida.
+    Sem parallel=True: o Streamlit executa cada sessão em uma thread própria e a camada
+    de threads padrão do Numba não aceita chamadas paralelas concorrentes.
+    """
+    for i in range(R.size):
+        outR[i] = quartil(R[i], qR)
+        outF[i] = 3 - quartil(F[i], qF)
+        outV[i] = 3 - quartil(V[i], qV)
+
+# Último dia de um cliente sem compra datada; também marca as linhas com DiaCompra vazio
+SEM_DATA = np.iinfo(np.int32).min
+
+@njit
+def agrega_rfv(codigos, dias, nova_compra, valores, n_clientes):
+    """Último dia de compra, compras distintas e valor total por cliente numa única passada.
+
+    codigos vem de pd.factorize(ID_cliente); nova_compra marca a primeira linha de cada
+    par (ID_cliente, CodigoCompra), de modo que somá-la conta as compras distintas.
+    """
+    ultimo_dia = np.full(n_clientes, SEM_DATA, dtype=np.int32)
+    frequencia = np.zeros(n_clientes, dtype=np.int64)
+    valor = np.zeros(n_clientes, dtype=np.float64)
+    for i in range(codigos.size):
+        g = codigos[i]
+        if dias[i] > ultimo_dia[g]:
+            ultimo_dia[g] = dias[i]
+        frequencia[g] += nova_compra[i]
+        # Como no groupby().sum(), ValorTotal vazio (NaN) não entra na soma
+        if valores[i] == valores[i]:
+            valor[g] += valores[i]
+    return ultimo_dia, frequencia, valor
+
+@st.cache_resource(show_spinner=False)
+def aquecer_jit():
+    """Compila os kernels Numba uma vez por processo com uma chamada de 16 linhas."""
+    x = np.zeros(16)
+    q = np.zeros(3)
+    classifica_rfv(x, x, x, q, q, q, np.empty(16, np.int8), np.empty(16, np.int8), np.empty(16, np.int8))
+    agrega_rfv(np.zeros(16, dtype=np.intp), np.zeros(16, dtype=np.int32), np.ones(16, dtype=np.bool_), x, 1)
+
+# Leitura do arquivo e pipeline RFV
+# ID_cliente e CodigoCompra ficam sem tipo fixo: podem vir vazios, e há códigos não numéricos (ex.: 'C537215')
+TIPOS_COMPRAS = {'ValorTotal': 'float64'}
+
+def carregar_compras(file_bytes, file_name):
+    """Lê o arquivo de compras (CSV ou Excel) a partir dos bytes enviados."""
+    if file_name.endswith('.csv'):
+        df_compras = pd.read_csv(BytesIO(file_bytes), engine='pyarrow', dtype=TIPOS_COMPRAS)
     else:
-        return 'A'
+        # No Excel, códigos mistos (números e textos) são lidos como str para a coluna caber no Parquet
+        df_compras = pd.read_excel(BytesIO(file_bytes), engine='calamine', dtype={**TIPOS_COMPRAS, 'CodigoCompra': str})
+    # Conversão depois da leitura: com parse_dates o pyarrow devolve as datas vazias como o texto 'None'
+    df_compras['DiaCompra'] = pd.to_datetime(df_compras['DiaCompra'])
+    return df_compras
+
+def compras_da_sessao(data_file):
+    """Retorna as compras do arquivo enviado em Parquet, lendo o CSV/Excel só no primeiro rerun.
+
+    Depois da primeira leitura, os bytes em Parquet ficam em st.session_state e os
+    reruns seguintes (slider, downloads) não passam de novo pelo parser.
+    """
+    if st.session_state.get('df_file_id') != data_file.file_id:
+        buf = BytesIO()
+        carregar_compras(data_file.getvalue(), data_file.name).to_parquet(buf, compression='zstd')
+        st.session_state['df_bytes'] = buf.getvalue()
+        st.session_state['df_file_id'] = data_file.file_id
+    return st.session_state['df_bytes']
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def build_rfv(dados_parquet):
+    """Calcula a tabela RFV segmentada e os quartis de Recência, Frequência e Valor.
+
+    Recebe as compras já convertidas em Parquet (ver compras_da_sessao); o cache é
+    indexado por esses bytes.
+    """
+    df_compras = pd.read_parquet(BytesIO(dados_parquet))
+
+    # Datas convertidas uma vez para dias desde a época (int32): a Recência vira uma subtração de inteiros
+    datas = df_compras['DiaCompra'].values.astype('datetime64[D]')
+    dias = datas.astype(np.int32)
+    # Datas vazias (NaT) recebem o valor inicial do kernel e nunca contam como última compra
+    dias[np.isnat(datas)] = SEM_DATA
+
+    # Recência, Frequência e Valor numa única passada do kernel, sobre os códigos de cliente
+    codigos, clientes = pd.factorize(df_compras['ID_cliente'], sort=False)
+    # Como no nunique, compras sem código não contam
+    nova_compra = (
+        ~df_compras.duplicated(['ID_cliente', 'CodigoCompra']) & df_compras['CodigoCompra'].notna()
+    ).to_numpy()
+    valores = df_compras['ValorTotal'].to_numpy(dtype=np.float64)
+    dia_atual = dias.max()
+    # Como no groupby, linhas sem ID_cliente (código -1 do factorize) ficam de fora
+    if (codigos < 0).any():
+        com_id = codigos >= 0
+        codigos, dias, nova_compra, valores = codigos[com_id], dias[com_id], nova_compra[com_id], valores[com_id]
+    ultimo_dia, frequencia, valor = agrega_rfv(codigos, dias, nova_compra, valores, len(clientes))
+    # Como no groupby().max(), cliente sem nenhuma data fica com Recência NaN
+    recencia = dia_atual - ultimo_dia
+    sem_data = ultimo_dia == SEM_DATA
+    if sem_data.any():
+        recencia = np.where(sem_data, np.nan, recencia)
+    df_RFV = pd.DataFrame({
+        'ID_cliente': clientes,
+        'Recencia': recencia,
+        'Frequencia': frequencia,
+        'Valor': valor
+    })
+
+    # Quartis e Classificação
+    quartis = np.nanquantile(
+        df_RFV[['Recencia', 'Frequencia', 'Valor']].to_numpy(dtype=np.float64), [0.25, 0.5, 0.75], axis=0
+    )
+    r, f, v = (np.empty(len(df_RFV), dtype=np.int8) for _ in range(3))
+    classifica_rfv(
+        df_RFV['Recencia'].to_numpy(dtype=np.float64),
+        df_RFV['Frequencia'].to_numpy(dtype=np.float64),
+        df_RFV['Valor'].to_numpy(dtype=np.float64),
+        *np.ascontiguousarray(quartis.T),
+        r, f, v
+    )
+    # Recência NaN não passa em nenhum limite e cai em 'D', como no recencia_class original
+    r[sem_data] = 3
+    df_RFV['R_quartil'] = LETRAS_QUARTIS[r]
+    df_RFV['F_quartil'] = LETRAS_QUARTIS[f]
+    df_RFV['V_quartil'] = LETRAS_QUARTIS[v]
+    df_RFV['RFV_Score'] = pd.Categorical.from_codes(r * 16 + f * 4 + v, categories=TABELA_SCORES)
+    return df_RFV, quartis
 
 # Função Principal da Aplicação
 def main():
+    aquecer_jit()
+
     # Título e Descrição
     st.title("RFV - Segmentação de Clientes")
     st.write(""" 
@@ -74,10 +218,8 @@ def main():
     if data_file:
         # Tentativa de Leitura do Arquivo
         try:
-            if data_file.name.endswith('.csv'):
-                df_compras = pd.read_csv(data_file, parse_dates=['DiaCompra'], infer_datetime_format=True)
-            else:
-                df_compras = pd.read_excel(data_file, parse_dates=['DiaCompra'], infer_datetime_format=True)
+            dados_parquet = compras_da_sessao(data_file)
+            df_compras = pd.read_parquet(BytesIO(dados_parquet))
         except Exception as e:
             st.error(f"⚠️ Erro ao carregar o arquivo: {e}")
             st.stop()
@@ -92,51 +234,44 @@ def main():
         st.subheader("📊 Prévia dos Dados Carregados")
         st.dataframe(df_compras.head())
 
-        # Cálculo da Recência
-        st.write('## 📅 Recência (R)')
+        # Cálculo da Tabela RFV (em cache enquanto o arquivo não mudar)
+        df_RFV, quartis = build_rfv(dados_parquet)
         dia_atual = df_compras['DiaCompra'].max()
+
+        # Recência
+        st.write('## 📅 Recência (R)')
         st.write(f'Data Atual Considerada: **{dia_atual.date()}**')
-        df_recencia = df_compras.groupby('ID_cliente', as_index=False)['DiaCompra'].max()
-        df_recencia['Recencia'] = (dia_atual - df_recencia['DiaCompra']).dt.days
-        df_recencia.drop(columns=['DiaCompra'], inplace=True)
         st.write('### Recência por Cliente')
-        st.dataframe(df_recencia.head())
+        st.dataframe(df_RFV[['ID_cliente', 'Recencia']].head())
 
-        # Cálculo da Frequência
+        # Frequência
         st.write('## 📈 Frequência (F)')
-        df_frequencia = df_compras.groupby('ID_cliente', as_index=False)['CodigoCompra'].nunique()
-        df_frequencia.columns = ['ID_cliente', 'Frequencia']
         st.write('### Frequência de Compras por Cliente')
-        st.dataframe(df_frequencia.head())
+        st.dataframe(df_RFV[['ID_cliente', 'Frequencia']].head())
 
-        # Cálculo do Valor
+        # Valor
         st.write('## 💰 Valor (V)')
-        df_valor = df_compras.groupby('ID_cliente', as_index=False)['ValorTotal'].sum()
-        df_valor.columns = ['ID_cliente', 'Valor']
         st.write('### Valor Total Gasto por Cliente')
-        st.dataframe(df_valor.head())
+        st.dataframe(df_RFV[['ID_cliente', 'Valor']].head())
 
-        # Merge das Componentes RFV
-        df_RFV = df_recencia.merge(df_frequencia, on='ID_cliente').merge(df_valor, on='ID_cliente')
+        # Tabela RFV
         st.write('## 📋 Tabela RFV Final')
-        st.dataframe(df_RFV.head())
+        st.dataframe(df_RFV[['ID_cliente', 'Recencia', 'Frequencia', 'Valor']].head())
 
         # Cálculo dos Quartis
-        quartis = df_RFV.quantile(q=[0.25, 0.5, 0.75])
+        colunas_rfv = ['Recencia', 'Frequencia', 'Valor']
         st.write('## 📊 Quartis para RFV')
-        st.dataframe(quartis)
+        st.dataframe(pd.DataFrame(quartis, index=[0.25, 0.5, 0.75], columns=colunas_rfv))
 
-        # Aplicação das Funções de Classificação
-        df_RFV['R_quartil'] = df_RFV['Recencia'].apply(recencia_class, args=('Recencia', quartis))
-        df_RFV['F_quartil'] = df_RFV['Frequencia'].apply(freq_val_class, args=('Frequencia', quartis))
-        df_RFV['V_quartil'] = df_RFV['Valor'].apply(freq_val_class, args=('Valor', quartis))
-        df_RFV['RFV_Score'] = df_RFV['R_quartil'] + df_RFV['F_quartil'] + df_RFV['V_quartil']
+        # Classificação por Quartis
         st.write('## 🏷️ Tabela Segmentada RFV')
         st.dataframe(df_RFV.head())
 
         # Contagem de Clientes por Score RFV
         st.write('## 📊 Quantidade de Clientes por RFV Score')
-        st.bar_chart(df_RFV['RFV_Score'].value_counts())
+        # Sem ordenação: o bar_chart ordena o eixo pelos rótulos de qualquer forma
+        contagem_scores = df_RFV['RFV_Score'].value_counts(sort=False)
+        st.bar_chart(contagem_scores[contagem_scores > 0])
 
         # Clientes de Destaque
         st.write('### 🌟 Clientes com Melhor Segmento (AAA)')
@@ -157,10 +292,23 @@ def main():
             'DDD': 'Clientes inativos, sem ações planejadas.'
             # Adicione mais mapeamentos conforme necessário
         }
-        df_RFV['Ações de Marketing'] = df_RFV['RFV_Score'].map(dict_acoes).fillna('Ação padrão para segmentos não definidos.')
-        # Corrigir o erro no rename e aplicar a contagem corretamente
-        contagem_segmentos = df_RFV[['RFV_Score', 'Ações de Marketing']].value_counts().reset_index(name='Contagem')
-        contagem_segmentos.columns = ['RFV_Score', 'Ações de Marketing', 'Contagem']
+        # A ação é definida por score: o mapeamento roda sobre as 64 categorias, não sobre cada cliente
+        acoes = np.array([
+            dict_acoes.get(score, 'Ação padrão para segmentos não definidos.')
+            for score in df_RFV['RFV_Score'].cat.categories
+        ])
+        categorias_acoes, codigos_acoes = np.unique(acoes, return_inverse=True)
+        df_RFV['Ações de Marketing'] = pd.Categorical.from_codes(
+            codigos_acoes[df_RFV['RFV_Score'].cat.codes], categories=categorias_acoes
+        )
+        # Como a ação depende só do score, basta contar os scores e anexar a ação ao resultado
+        contagem = np.bincount(df_RFV['RFV_Score'].cat.codes, minlength=len(acoes))
+        observados = np.flatnonzero(contagem)
+        contagem_segmentos = pd.DataFrame({
+            'RFV_Score': df_RFV['RFV_Score'].cat.categories[observados],
+            'Ações de Marketing': acoes[observados],
+            'Contagem': contagem[observados]
+        }).sort_values('Contagem', ascending=False, kind='stable', ignore_index=True)
         st.dataframe(contagem_segmentos)
 
         # Download dos Resultados
@@ -176,6 +324,12 @@ def main():
             file_name="clientes_segmentados_rfv.csv",
             mime="text/csv"
         )
+        st.download_button(
+            label="🔽 Baixar Tabela RFV em Parquet",
+            data=to_parquet(df_RFV),
+            file_name="clientes_segmentados_rfv.parquet",
+            mime="application/octet-stream"
+        )
 
 if __name__ == "__main__":
     main()
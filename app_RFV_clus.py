@@ -3,10 +3,11 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 from datetime import datetime
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
+from sklearn.cluster import KMeans, MiniBatchKMeans
 import matplotlib.pyplot as plt
 from io import BytesIO
+import xlsxwriter
+from numba import njit
 
 # Configuração inicial da página
 st.set_page_config(
@@ -22,35 +23,188 @@ def convert_df(df):
 
 @st.cache_data
 def to_excel(df):
+    # constant_memory exige escrita linha a linha (df.to_excel grava coluna a coluna)
     output = BytesIO()
-    writer = pd.ExcelWriter(output, engine='xlsxwriter')
-    df.to_excel(writer, index=False, sheet_name='RFV_Segmentado')
-    writer.close()
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'strings_to_numbers': False})
+    worksheet = workbook.add_worksheet('RFV_Segmentado')
+    worksheet.write_row(0, 0, df.columns, workbook.add_format({'bold': True}))
+    for linha, valores in enumerate(df.itertuples(index=False, name=None), start=1):
+        # write_number não aceita NaN: None vira célula vazia, como no df.to_excel
+        worksheet.write_row(linha, 0, [None if pd.isna(v) else v for v in valores])
+    workbook.close()
     return output.getvalue()
 
+@st.cache_data
+def to_parquet(df):
+    return df.to_parquet(index=False)
+
 # Funções para Classificação
-def recencia_class(x, r, q_dict):
-    if x <= q_dict[r][0.25]:
-        return 'A'
-    elif x <= q_dict[r][0.50]:
-        return 'B'
-    elif x <= q_dict[r][0.75]:
-        return 'C'
+LETRAS_QUARTIS = np.array(list('ABCD'))
+TABELA_SCORES = np.array([r + f + v for r in 'ABCD' for f in 'ABCD' for v in 'ABCD'])
+
+@njit(inline='always')
+def quartil(x, q):
+    if x <= q[0]:
+        return 0
+    elif x <= q[1]:
+        return 1
+    elif x <= q[2]:
+        return 2
+    else:
+        return 3
+
+# Sem parallel=True: cada sessão do Streamlit roda em uma thread própria
+@njit(fastmath=True)
+def classifica_rfv(R, F, V, qR, qF, qV, outR, outF, outV):
+    for i in range(R.size):
+        outR[i] = quartil(R[i], qR)
+        outF[i] = 3 - quartil(F[i], qF)
+        outV[i] = 3 - quartil(V[i], qV)
+
+# Último dia de um cliente sem compra datada; também marca as linhas com DiaCompra vazio
+SEM_DATA = np.iinfo(np.int32).min
+
+@njit
+def agrega_rfv(codigos, dias, nova_compra, valores, n_clientes):
+    ultimo_dia = np.full(n_clientes, SEM_DATA, dtype=np.int32)
+    frequencia = np.zeros(n_clientes, dtype=np.int64)
+    valor = np.zeros(n_clientes, dtype=np.float64)
+    for i in range(codigos.size):
+        g = codigos[i]
+        if dias[i] > ultimo_dia[g]:
+            ultimo_dia[g] = dias[i]
+        frequencia[g] += nova_compra[i]
+        # Como no groupby().sum(), ValorTotal vazio (NaN) não entra na soma
+        if valores[i] == valores[i]:
+            valor[g] += valores[i]
+    return ultimo_dia, frequencia, valor
+
+@st.cache_resource(show_spinner=False)
+def aquecer_jit():
+    x = np.zeros(16)
+    q = np.zeros(3)
+    classifica_rfv(x, x, x, q, q, q, np.empty(16, np.int8), np.empty(16, np.int8), np.empty(16, np.int8))
+    agrega_rfv(np.zeros(16, dtype=np.intp), np.zeros(16, dtype=np.int32), np.ones(16, dtype=np.bool_), x, 1)
+
+# Leitura do arquivo e pipeline RFV
+# ID_cliente e CodigoCompra ficam sem tipo fixo: podem vir vazios, e há códigos não numéricos (ex.: 'C537215')
+TIPOS_COMPRAS = {'ValorTotal': 'float64'}
+
+def carregar_compras(file_bytes, file_name):
+    if file_name.endswith('.csv'):
+        df_compras = pd.read_csv(BytesIO(file_bytes), engine='pyarrow', dtype=TIPOS_COMPRAS)
+    else:
+        # No Excel, códigos mistos (números e textos) são lidos como str para a coluna caber no Parquet
+        df_compras = pd.read_excel(BytesIO(file_bytes), engine='calamine', dtype={**TIPOS_COMPRAS, 'CodigoCompra': str})
+    # Conversão depois da leitura: com parse_dates o pyarrow devolve as datas vazias como o texto 'None'
+    df_compras['DiaCompra'] = pd.to_datetime(df_compras['DiaCompra'])
+    return df_compras
+
+# O CSV/Excel só é lido no primeiro rerun; depois as compras vêm do Parquet guardado na sessão
+def compras_da_sessao(data_file):
+    if st.session_state.get('df_file_id') != data_file.file_id:
+        buf = BytesIO()
+        carregar_compras(data_file.getvalue(), data_file.name).to_parquet(buf, compression='zstd')
+        st.session_state['df_bytes'] = buf.getvalue()
+        st.session_state['df_file_id'] = data_file.file_id
+    return st.session_state['df_bytes']
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def build_rfv(dados_parquet):
+    df_compras = pd.read_parquet(BytesIO(dados_parquet))
+
+    # Datas convertidas uma vez para dias desde a época (int32): a Recência vira uma subtração de inteiros
+    datas = df_compras['DiaCompra'].values.astype('datetime64[D]')
+    dias = datas.astype(np.int32)
+    # Datas vazias (NaT) recebem o valor inicial do kernel e nunca contam como última compra
+    dias[np.isnat(datas)] = SEM_DATA
+
+    # Recência, Frequência e Valor numa única passada do kernel, sobre os códigos de cliente
+    codigos, clientes = pd.factorize(df_compras['ID_cliente'], sort=False)
+    # Como no nunique, compras sem código não contam
+    nova_compra = (
+        ~df_compras.duplicated(['ID_cliente', 'CodigoCompra']) & df_compras['CodigoCompra'].notna()
+    ).to_numpy()
+    valores = df_compras['ValorTotal'].to_numpy(dtype=np.float64)
+    dia_atual = dias.max()
+    # Como no groupby, linhas sem ID_cliente (código -1 do factorize) ficam de fora
+    if (codigos < 0).any():
+        com_id = codigos >= 0
+        codigos, dias, nova_compra, valores = codigos[com_id], dias[com_id], nova_compra[com_id], valores[com_id]
+    ultimo_dia, frequencia, valor = agrega_rfv(codigos, dias, nova_compra, valores, len(clientes))
+    # Como no groupby().max(), cliente sem nenhuma data fica com Recência NaN
+    recencia = dia_atual - ultimo_dia
+    sem_data = ultimo_dia == SEM_DATA
+    if sem_data.any():
+        recencia = np.where(sem_data, np.nan, recencia)
+    df_RFV = pd.DataFrame({
+        'ID_cliente': clientes,
+        'Recencia': recencia,
+        'Frequencia': frequencia,
+        'Valor': valor
+    })
+
+    # Quartis e Classificação
+    quartis = np.nanquantile(
+        df_RFV[['Recencia', 'Frequencia', 'Valor']].to_numpy(dtype=np.float64), [0.25, 0.5, 0.75], axis=0
+    )
+    r, f, v = (np.empty(len(df_RFV), dtype=np.int8) for _ in range(3))
+    classifica_rfv(
+        df_RFV['Recencia'].to_numpy(dtype=np.float64),
+        df_RFV['Frequencia'].to_numpy(dtype=np.float64),
+        df_RFV['Valor'].to_numpy(dtype=np.float64),
+        *np.ascontiguousarray(quartis.T),
+        r, f, v
+    )
+    # Recência NaN não passa em nenhum limite e cai em 'D', como no recencia_class original
+    r[sem_data] = 3
+    df_RFV['R_quartil'] = LETRAS_QUARTIS[r]
+    df_RFV['F_quartil'] = LETRAS_QUARTIS[f]
+    df_RFV['V_quartil'] = LETRAS_QUARTIS[v]
+    df_RFV['RFV_Score'] = pd.Categorical.from_codes(r * 16 + f * 4 + v, categories=TABELA_SCORES)
+    return df_RFV
+
+# Acima deste número de clientes o ajuste usa MiniBatchKMeans; abaixo, o KMeans completo
+# é rápido o bastante e encontra agrupamentos melhores
+LIMITE_MINIBATCH = 50_000
+
+# Acima deste número de pontos o gráfico de clusters usa st.scatter_chart em vez do Matplotlib
+LIMITE_PONTOS_MATPLOTLIB = 100_000
+
+# init (centróides de partida, ou None para k-means++) faz parte da chave do cache: o cache é
+# compartilhado entre sessões, e o resultado não pode depender de quem ajustou aquele k primeiro.
+# max_entries cobre os 9 valores do slider para até 4 arquivos
+@st.cache_resource(show_spinner=False, max_entries=4 * 9)
+def fit_kmeans(X, k, init=None):
+    if init is None:
+        init, n_init = 'k-means++', 3
     else:
-        return 'D'
-
-def freq_val_class(x, fv, q_dict):
-    if x <= q_dict[fv][0.25]:
-        return 'D'
-    elif x <= q_dict[fv][0.50]:
-        return 'C'
-    elif x <= q_dict[fv][0.75]:
-        return 'B'
+        n_init = 1
+    if len(X) > LIMITE_MINIBATCH:
+        kmeans = MiniBatchKMeans(
+            n_clusters=k,
+            init=init,
+            n_init=n_init,
+            batch_size=4096,
+            max_iter=100,
+            random_state=42
+        )
     else:
-        return 'A'
+        # Uma única inicialização k-means++ com Elkan (desigualdade triangular poda distâncias)
+        kmeans = KMeans(
+            n_clusters=k,
+            init=init,
+            n_init=1,
+            algorithm='elkan',
+            tol=1e-3,
+            max_iter=100,
+            random_state=42
+        )
+    return kmeans.fit(X)
 
 # Função Principal
 def main():
+    aquecer_jit()
     st.title("RFV - Segmentação de Clientes")
     st.write("""
     **RFV (Recência, Frequência, Valor)** é uma técnica para segmentação de clientes com base no comportamento de compras.
@@ -63,10 +217,8 @@ def main():
 
     if data_file:
         try:
-            if data_file.name.endswith('.csv'):
-                df_compras = pd.read_csv(data_file, parse_dates=['DiaCompra'], infer_datetime_format=True)
-            else:
-                df_compras = pd.read_excel(data_file, parse_dates=['DiaCompra'], infer_datetime_format=True)
+            dados_parquet = compras_da_sessao(data_file)
+            df_compras = pd.read_parquet(BytesIO(dados_parquet))
         except Exception as e:
             st.error(f"⚠️ Erro ao carregar o arquivo: {e}")
             st.stop()
@@ -79,29 +231,8 @@ def main():
         st.subheader("📊 Prévia dos Dados Carregados")
         st.dataframe(df_compras.head())
 
-        # Recência
-        dia_atual = df_compras['DiaCompra'].max()
-        df_recencia = df_compras.groupby('ID_cliente', as_index=False)['DiaCompra'].max()
-        df_recencia['Recencia'] = (dia_atual - df_recencia['DiaCompra']).dt.days
-        df_recencia.drop(columns=['DiaCompra'], inplace=True)
-
-        # Frequência
-        df_frequencia = df_compras.groupby('ID_cliente', as_index=False)['CodigoCompra'].nunique()
-        df_frequencia.columns = ['ID_cliente', 'Frequencia']
-
-        # Valor
-        df_valor = df_compras.groupby('ID_cliente', as_index=False)['ValorTotal'].sum()
-        df_valor.columns = ['ID_cliente', 'Valor']
-
-        # Merge das Componentes RFV
-        df_RFV = df_recencia.merge(df_frequencia, on='ID_cliente').merge(df_valor, on='ID_cliente')
-
-        # Quartis e Classificação
-        quartis = df_RFV.quantile(q=[0.25, 0.5, 0.75])
-        df_RFV['R_quartil'] = df_RFV['Recencia'].apply(recencia_class, args=('Recencia', quartis))
-        df_RFV['F_quartil'] = df_RFV['Frequencia'].apply(freq_val_class, args=('Frequencia', quartis))
-        df_RFV['V_quartil'] = df_RFV['Valor'].apply(freq_val_class, args=('Valor', quartis))
-        df_RFV['RFV_Score'] = df_RFV['R_quartil'] + df_RFV['F_quartil'] + df_RFV['V_quartil']
+        # Tabela RFV (em cache enquanto o arquivo não mudar)
+        df_RFV = build_rfv(dados_parquet)
 
         # Escolha da Quantidade de Clusters
         st.sidebar.header("🔢 Configuração de Clusterização")
@@ -114,10 +245,29 @@ def main():
         )
 
         # Clusterização
-        scaler = StandardScaler()
-        rfv_scaled = scaler.fit_transform(df_RFV[['Recencia', 'Frequencia', 'Valor']])
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-        df_RFV['Cluster'] = kmeans.fit_predict(rfv_scaled)
+        # Padronização em float32 (o StandardScaler converteria para float64)
+        rfv = df_RFV[['Recencia', 'Frequencia', 'Valor']].to_numpy(dtype=np.float32)
+        # Clientes sem compra datada (Recência NaN) entram na clusterização com a maior Recência
+        sem_data = np.isnan(rfv[:, 0])
+        if sem_data.any():
+            rfv[sem_data, 0] = np.nanmax(rfv[:, 0])
+        desvio = rfv.std(axis=0)
+        rfv_scaled = (rfv - rfv.mean(axis=0)) / np.where(desvio > 0, desvio, 1)
+        # Ajuste anterior do mesmo arquivo: reaproveitado se k não mudou; quando k diminui,
+        # seus centróides são o ponto de partida (k-means++ quando aumenta)
+        anterior = None
+        if st.session_state.get('km_file_id') == data_file.file_id:
+            anterior = st.session_state.get('last_km')
+        if anterior is not None and anterior.n_clusters == n_clusters:
+            kmeans = anterior
+        else:
+            init = None
+            if anterior is not None and anterior.n_clusters > n_clusters:
+                init = anterior.cluster_centers_[:n_clusters]
+            kmeans = fit_kmeans(rfv_scaled, n_clusters, init)
+            st.session_state['last_km'] = kmeans
+            st.session_state['km_file_id'] = data_file.file_id
+        df_RFV['Cluster'] = kmeans.labels_
 
         # Descrição dos Clusters
         st.subheader("📋 Tabela RFV com Clusterização")
@@ -128,18 +278,35 @@ def main():
         st.dataframe(cluster_summary)
 
         st.write('### 📈 Visualização dos Clusters RFV')
-        plt.figure(figsize=(10, 6))
-        for cluster in range(n_clusters):
-            plt.scatter(
-                rfv_scaled[df_RFV['Cluster'] == cluster, 0],
-                rfv_scaled[df_RFV['Cluster'] == cluster, 1],
-                label=f'Cluster {cluster}'
+        if len(df_RFV) > LIMITE_PONTOS_MATPLOTLIB:
+            # Bases grandes: gráfico nativo do Streamlit, renderizado no navegador
+            st.scatter_chart(
+                pd.DataFrame({
+                    'Recência (Normalizada)': rfv_scaled[:, 0],
+                    'Frequência (Normalizada)': rfv_scaled[:, 1],
+                    'Cluster': df_RFV['Cluster'].astype(str).values
+                }),
+                x='Recência (Normalizada)',
+                y='Frequência (Normalizada)',
+                color='Cluster'
             )
-        plt.xlabel('Recência (Normalizada)')
-        plt.ylabel('Frequência (Normalizada)')
-        plt.title(f'Clusters RFV ({n_clusters} grupos)')
-        plt.legend()
-        st.pyplot(plt)
+        else:
+            # Um único scatter colorido pelo rótulo, em vez de uma máscara e um desenho por cluster
+            fig, ax = plt.subplots(figsize=(10, 6))
+            pontos = ax.scatter(
+                rfv_scaled[:, 0],
+                rfv_scaled[:, 1],
+                c=df_RFV['Cluster'].values,
+                cmap='viridis',
+                s=4,
+                rasterized=True
+            )
+            handles, _ = pontos.legend_elements(num=None)
+            ax.legend(handles, [f'Cluster {cluster}' for cluster in np.unique(df_RFV['Cluster'].values)])
+            ax.set_xlabel('Recência (Normalizada)')
+            ax.set_ylabel('Frequência (Normalizada)')
+            ax.set_title(f'Clusters RFV ({n_clusters} grupos)')
+            st.pyplot(fig, clear_figure=True)
 
         st.download_button(
             label="🔽 Baixar Tabela RFV Segmentada",
@@ -147,6 +314,12 @@ def main():
             file_name="clientes_segmentados_rfv.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
+        st.download_button(
+            label="🔽 Baixar Tabela RFV Segmentada em Parquet",
+            data=to_parquet(df_RFV),
+            file_name="clientes_segmentados_rfv.parquet",
+            mime="application/octet-stream"
+        )
 
 if __name__ == "__main__":
     main()
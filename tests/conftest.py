@@ -0,0 +1,18 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+RAIZ = Path(__file__).resolve().parent.parent
+
+
+def carregar_app(nome):
+    spec = importlib.util.spec_from_file_location(nome, RAIZ / f'{nome}.py')
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+@pytest.fixture(scope='module', params=['app_RFV', 'app_RFV_clus'])
+def app(request):
+    return carregar_app(request.param)
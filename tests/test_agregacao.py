@@ -0,0 +1,85 @@
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+
+def test_agrega_rfv_ignora_valor_vazio(app):
+    codigos = np.array([0, 0, 1, 1, 2], dtype=np.int64)
+    dias = np.array([10, 12, 5, 3, 7], dtype=np.int32)
+    nova_compra = np.array([True, True, True, False, True])
+    valores = np.array([1.5, np.nan, np.nan, np.nan, 4.0])
+
+    ultimo_dia, frequencia, valor = app.agrega_rfv(codigos, dias, nova_compra, valores, 3)
+
+    assert ultimo_dia.tolist() == [12, 5, 7]
+    assert frequencia.tolist() == [2, 1, 1]
+    assert valor.tolist() == [1.5, 0.0, 4.0]
+
+
+def compras_exemplo():
+    """Compras de 9 clientes com Recência, Frequência e Valor caindo exatamente nos quartis.
+
+    Cada compra tem dois itens (par ID_cliente/CodigoCompra repetido), cada cliente tem uma
+    linha sem código e sem valor, o cliente 9 não tem nenhuma data e há linhas sem ID_cliente.
+    """
+    fim = pd.Timestamp('2021-01-31')
+    recencias = [0, 10, 10, 20, 20, 30, 30, 40, None]
+    linhas = []
+    for cliente, recencia in enumerate(recencias, start=1):
+        for compra in range(cliente // 2 + 1):
+            dia = pd.NaT if recencia is None else fim - pd.Timedelta(days=recencia + 7 * compra)
+            codigo = f'C{cliente}{compra}'
+            linhas.append((cliente, codigo, dia, 10.0 * cliente if compra == 0 else 0.0))
+            linhas.append((cliente, codigo, dia, 0.0))
+        linhas.append((cliente, None, fim - pd.Timedelta(days=60), np.nan))
+    linhas.append((1, 'C19', pd.NaT, 0.0))
+    linhas.append((None, 'C99', fim, 1000.0))
+    linhas.append((None, None, fim, 1000.0))
+    return pd.DataFrame(linhas, columns=['ID_cliente', 'CodigoCompra', 'DiaCompra', 'ValorTotal'])
+
+
+def rfv_referencia(df_compras):
+    """Cálculo original: groupby max/nunique/sum, quartis do pandas e classificação linha a linha."""
+    dia_atual = df_compras['DiaCompra'].max()
+    por_cliente = df_compras.groupby('ID_cliente')
+    ref = pd.DataFrame({
+        'Recencia': (dia_atual - por_cliente['DiaCompra'].max()).dt.days,
+        'Frequencia': por_cliente['CodigoCompra'].nunique(),
+        'Valor': por_cliente['ValorTotal'].sum(),
+    })
+    quartis = ref.quantile(q=[0.25, 0.5, 0.75])
+
+    def letra(x, q, letras):
+        for limite, l in zip(q, letras):
+            if x <= limite:
+                return l
+        return letras[-1]
+
+    ref['R_quartil'] = ref['Recencia'].apply(letra, args=(quartis['Recencia'], 'ABCD'))
+    ref['F_quartil'] = ref['Frequencia'].apply(letra, args=(quartis['Frequencia'], 'DCBA'))
+    ref['V_quartil'] = ref['Valor'].apply(letra, args=(quartis['Valor'], 'DCBA'))
+    ref['RFV_Score'] = ref['R_quartil'] + ref['F_quartil'] + ref['V_quartil']
+    return ref, quartis
+
+
+def test_build_rfv_igual_ao_groupby(app):
+    df_compras = compras_exemplo()
+    ref, quartis_ref = rfv_referencia(df_compras)
+    # O exemplo só cobre o caso de borda se houver clientes exatamente sobre os quartis
+    for coluna in ['Recencia', 'Frequencia', 'Valor']:
+        assert ref[coluna].isin(quartis_ref[coluna]).sum() >= 3
+
+    buf = BytesIO()
+    df_compras.to_parquet(buf)
+    df_RFV = app.build_rfv(buf.getvalue())
+    # app_RFV também devolve os quartis para exibi-los
+    if isinstance(df_RFV, tuple):
+        df_RFV, quartis = df_RFV
+        np.testing.assert_allclose(quartis, quartis_ref.to_numpy())
+    df_RFV = df_RFV.set_index('ID_cliente').loc[ref.index]
+
+    pd.testing.assert_series_equal(df_RFV['Recencia'], ref['Recencia'], check_dtype=False)
+    for coluna in ['Frequencia', 'Valor', 'R_quartil', 'F_quartil', 'V_quartil']:
+        pd.testing.assert_series_equal(df_RFV[coluna], ref[coluna], check_dtype=False)
+    assert df_RFV['RFV_Score'].astype(str).tolist() == ref['RFV_Score'].tolist()
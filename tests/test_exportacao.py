@@ -0,0 +1,20 @@
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+
+def test_to_excel_com_nan(app):
+    df = pd.DataFrame({
+        'ID_cliente': [1, 2, 3],
+        'Valor': [10.5, np.nan, 7.0],
+        'RFV_Score': ['AAA', None, 'DDD'],
+    })
+
+    lido = pd.read_excel(BytesIO(app.to_excel(df)), engine='calamine', sheet_name='RFV_Segmentado')
+
+    assert list(lido.columns) == list(df.columns)
+    assert lido['ID_cliente'].tolist() == [1, 2, 3]
+    assert lido['Valor'].isna().tolist() == [False, True, False]
+    assert lido.loc[[0, 2], 'Valor'].tolist() == [10.5, 7.0]
+    assert lido['RFV_Score'].isna().tolist() == [False, True, False]